@@ -1,15 +1,55 @@
 """A Python script to monitor system resources for a given PID and optionally create
 a py-spy profiler report."""
 
+import atexit
+import os
+import re
+import sys
 import psutil
 import pynvml
 import time
 import subprocess
+import tempfile
 import click
-import threading
 import csv
 from pathlib import Path
-from typing import List
+from statistics import fmean
+from typing import IO, Dict, List, Optional, Pattern, Set, Tuple
+
+SAMPLE_LOG_TEMPLATE = "[%.1f%%] CPU: %.2f%%, RAM: %.2fMB, GPU: %.2f%%, VRAM: %.2fMB"
+CSV_FIELDNAMES = ["CPU (%)", "RAM (MB)", "GPU (%)", "VRAM (MB)"]
+CSV_BUFFER_SIZE = 64 * 1024
+CSV_FLUSH_EVERY = 10  # samples
+SKIPPED_STATUSES = {psutil.STATUS_ZOMBIE, psutil.STATUS_DEAD}
+
+LINUX = sys.platform.startswith("linux")
+if LINUX:
+    CLOCK_TICKS = os.sysconf("SC_CLK_TCK")
+    PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+    # Map the state letters of /proc/<pid>/stat to psutil statuses.
+    PROC_STAT_STATUSES = {
+        "R": psutil.STATUS_RUNNING,
+        "S": psutil.STATUS_SLEEPING,
+        "D": psutil.STATUS_DISK_SLEEP,
+        "T": psutil.STATUS_STOPPED,
+        "t": psutil.STATUS_TRACING_STOP,
+        "Z": psutil.STATUS_ZOMBIE,
+        "X": psutil.STATUS_DEAD,
+        "x": psutil.STATUS_DEAD,
+        "W": psutil.STATUS_WAKING,
+        "I": psutil.STATUS_IDLE,
+        "P": psutil.STATUS_PARKED,
+    }
+
+# Last (CPU time, monotonic timestamp) seen per PID by `sample_all`.
+_cpu_times_cache: Dict[int, Tuple[float, float]] = {}
+
+# Timestamp of the last per-process utilization sample seen per GPU index by
+# `process_gpu_utilization`.
+_gpu_util_timestamps: Dict[int, int] = {}
+
+# Whether NVML was initialized by `ensure_nvml`.
+_nvml_initialized = False
 
 
 def is_running_inside_container():
@@ -23,80 +63,287 @@ def is_running_inside_container():
         return False
 
 
-def get_all_processes(pid: int) -> List[psutil.Process]:
+def get_all_processes(parent: psutil.Process) -> List[psutil.Process]:
     """Return the parent process and all its children.
 
     Args:
-        pid: Parent process ID.
+        parent: Parent process.
 
     Returns:
         List of all processes (parent and children).
     """
     try:
-        parent = psutil.Process(pid)
         children = parent.children(recursive=True)
         return [parent] + children
     except psutil.NoSuchProcess:
         return []
 
 
-def total_cpu_percent(pids: List[psutil.Process]) -> float:
-    """Return total CPU usage (%) for a list of process IDs.
+def read_child_pids(pid: int) -> Set[int]:
+    """Return the direct children of a process from ``/proc/<pid>/task/*/children``.
+
     Args:
-        pids: List of process IDs to monitor.
+        pid: Process ID to read.
 
     Returns:
-        Total CPU usage (%) for the process IDs.
+        Set of the process IDs of the direct children.
+
+    Raises:
+        OSError: If the children lists can't be read.
+    """
+    child_pids = set()
+    for tid in os.listdir(f"/proc/{pid}/task"):
+        try:
+            with open(f"/proc/{pid}/task/{tid}/children", "rb") as f:
+                child_pids.update(int(child) for child in f.read().split())
+        except FileNotFoundError:
+            if os.path.isdir(f"/proc/{pid}/task/{tid}"):
+                raise  # The kernel doesn't provide children lists
+            continue  # The thread exited while we were reading
+    return child_pids
+
+
+class ProcessTreeCache:
+    """Caches a process and its children across monitoring samples.
+
+    On Linux, the cached tree is validated on every call against the children lists
+    in ``/proc/<pid>/task/*/children`` of the cached processes, which only requires
+    reading a few files per process. The full recursive children walk, which scans
+    all of ``/proc``, is only repeated when a process was added to or removed from
+    the tree. On other platforms the tree is rebuilt on every call.
     """
-    if not pids:
-        return 0.0
 
-    # Prime CPU measurement for child processes.
-    for proc in pids:
+    def __init__(self, parent: psutil.Process, exclude_pids: Optional[Set[int]] = None):
+        """Initialize the cache.
+
+        Args:
+            parent: Parent process.
+            exclude_pids: Child process IDs to leave out of the tree.
+        """
+        self.parent = parent
+        self.pid = parent.pid
+        self.exclude_pids = exclude_pids or set()
+        self.procs: List[psutil.Process] = []
+
+    def refresh(self):
+        """Rebuild the cached process tree."""
+        self.procs = [
+            proc
+            for proc in get_all_processes(self.parent)
+            if proc.pid not in self.exclude_pids
+        ]
+
+    def get(self) -> List[psutil.Process]:
+        """Return the parent process and all its children.
+
+        Returns:
+            List of all processes (parent and children).
+
+        Raises:
+            psutil.NoSuchProcess: If the parent process terminated.
+        """
+        # is_running() compares the cached creation time, so a reused PID is not
+        # mistaken for the original parent.
+        if not self.parent.is_running() or self.parent.status() == psutil.STATUS_ZOMBIE:
+            raise psutil.NoSuchProcess(self.pid)
+
+        if not self._is_current():
+            self.refresh()
+        return self.procs
+
+    def _is_current(self) -> bool:
+        """Return whether the cached tree still matches the live process tree."""
+        if not LINUX or not self.procs:
+            return False
         try:
-            proc.cpu_percent(interval=None)  # Prime the reading
-        except (psutil.NoSuchProcess, psutil.AccessDenied, psutil.ZombieProcess):
-            continue  # Ignore inaccessible processes
+            child_pids = set()
+            for proc in self.procs:
+                child_pids.update(read_child_pids(proc.pid))
+        except OSError:
+            return False  # A process exited or children lists are unavailable
+        cached_child_pids = {proc.pid for proc in self.procs[1:]}
+        return child_pids - self.exclude_pids == cached_child_pids
+
+
+def read_proc_stat(pid: int) -> Tuple[str, str, float, int]:
+    """Return the name, status, CPU time and RSS of a process from its stat file.
+
+    Reading ``/proc/<pid>/stat`` directly avoids the per-attribute overhead of
+    psutil, which matters when sampling large process trees on Linux.
+
+    Args:
+        pid: Process ID to read.
+
+    Returns:
+        Tuple containing the process name as reported by the kernel (truncated to 15
+        characters), the psutil process status, the user + system CPU time in
+        seconds and the resident set size in bytes.
+    """
+    try:
+        with open(f"/proc/{pid}/stat", "rb") as f:
+            data = f.read()
+    except (FileNotFoundError, ProcessLookupError):
+        raise psutil.NoSuchProcess(pid) from None
+    except PermissionError:
+        raise psutil.AccessDenied(pid) from None
+
+    # The command name may contain spaces and parentheses, so it is delimited by the
+    # first "(" and the last ")" and only the fields after it are split.
+    name_end = data.rindex(b")")
+    name = data[data.index(b"(") + 1 : name_end].decode(errors="replace")
+    fields = data[name_end + 2 :].split()
+    state = fields[0].decode()
+    cpu_time = (int(fields[11]) + int(fields[12])) / CLOCK_TICKS
+    rss = int(fields[21]) * PAGE_SIZE
+    return name, PROC_STAT_STATUSES.get(state, state), cpu_time, rss
+
+
+def read_process_stats(proc: psutil.Process) -> Tuple[str, str, float, int]:
+    """Return the name, status, CPU time and RSS of a process.
+
+    Args:
+        proc: Process to read.
+
+    Returns:
+        Tuple containing the process name, the psutil process status, the user +
+        system CPU time in seconds and the resident set size in bytes.
+    """
+    if LINUX:
+        return read_proc_stat(proc.pid)
+
+    with proc.oneshot():
+        cpu_times = proc.cpu_times()
+        return (
+            proc.name(),
+            proc.status(),
+            cpu_times.user + cpu_times.system,
+            proc.memory_info().rss,
+        )
+
+
+def sample_all(
+    process_tree: ProcessTreeCache,
+    gpu_handles: list,
+    host_pid: Optional[int] = None,
+    ignore_re: Optional[Pattern] = None,
+) -> Tuple[float, ...]:
+    """Return CPU, RAM, GPU and VRAM usage for a process and all its children.
+
+    The process tree is traversed once per sample and every metric is read from the
+    same pass. CPU usage is derived from the CPU time consumed since the previous
+    call, so no extra sleep is needed to take a measurement. A process contributes 0%
+    CPU on the first call it is seen in. Zombie and dead children, as well as children
+    whose name matches ``ignore_re``, are skipped before any metric is read.
+
+    Args:
+        process_tree: Cached tree of the processes to monitor.
+        gpu_handles: NVML handles of the GPUs to query.
+        host_pid: Host PID to attribute GPU usage to (useful inside containers).
+        ignore_re: Pattern matching the names of child processes to skip.
 
-    time.sleep(0.1)  # Allow measurements to update
+    Returns:
+        Tuple containing total CPU usage (%), RAM usage (MB), GPU usage (%) and VRAM
+        usage (MB).
+    """
+    processes = process_tree.get()
 
-    # Get the real CPU usage for all processes.
+    now = time.monotonic()
     total_cpu = 0.0
-    for proc in pids:
+    total_mem = 0
+    cpu_times_by_pid = {}
+    monitored_pids = set()
+    for proc in processes:
         try:
-            total_cpu += proc.cpu_percent(interval=0.0)  # Get real CPU %
+            name, status, cpu_time, rss = read_process_stats(proc)
         except (psutil.NoSuchProcess, psutil.AccessDenied, psutil.ZombieProcess):
-            continue  # Ignore processes that disappeared
-    return total_cpu
+            continue  # Ignore processes that disappeared or we can't access
+        if status in SKIPPED_STATUSES:
+            continue
+        if ignore_re and proc.pid != process_tree.pid and ignore_re.search(name):
+            continue
+        monitored_pids.add(proc.pid)
+        total_mem += rss  # Count physical memory (RAM)
+
+        cpu_times_by_pid[proc.pid] = (cpu_time, now)
+        last = _cpu_times_cache.get(proc.pid)
+        if last is not None and now > last[1]:
+            total_cpu += max(0.0, cpu_time - last[0]) / (now - last[1]) * 100
+
+    # Only keep the processes that are still alive for the next measurement.
+    _cpu_times_cache.clear()
+    _cpu_times_cache.update(cpu_times_by_pid)
+
+    gpu_usage, vram_usage = total_gpu_usage(
+        {host_pid} if host_pid else monitored_pids, gpu_handles
+    )
+    return total_cpu, total_mem / (1024 * 1024), gpu_usage, vram_usage
+
+
+def ensure_nvml():
+    """Initialize NVML once per process and shut it down at interpreter exit."""
+    global _nvml_initialized
+    if not _nvml_initialized:
+        pynvml.nvmlInit()
+        atexit.register(pynvml.nvmlShutdown)
+        _nvml_initialized = True
+
+
+def get_gpu_handles() -> list:
+    """Return the NVML handles of all available GPUs.
+
+    Returns:
+        List of NVML device handles (empty if no GPU is available).
+    """
+    try:
+        return [
+            pynvml.nvmlDeviceGetHandleByIndex(i)
+            for i in range(pynvml.nvmlDeviceGetCount())
+        ]
+    except pynvml.NVMLError:
+        return []
+
 
+def process_gpu_utilization(index: int, handle, pids: Set[int]) -> Optional[float]:
+    """Return the GPU utilization (%) of a set of process IDs on a single GPU.
 
-def total_memory(pids: List[psutil.Process]) -> float:
-    """Return total memory usage (MB) for a list of process IDs.
+    Only the per-process samples NVML recorded since the previous call for the same
+    GPU are taken into account.
 
     Args:
-        pids: List of process IDs to monitor.
+        index: Index of the GPU, used to remember the last seen sample.
+        handle: NVML handle of the GPU.
+        pids: Set of process IDs to monitor.
 
     Returns:
-        Total memory usage in MB for the process IDs.
+        Total SM utilization (%) of the process IDs, or None if per-process
+        utilization can't be queried on the GPU.
     """
-    if not pids:
-        return 0.0
+    last_seen = _gpu_util_timestamps.get(index, 0)
+    try:
+        samples = pynvml.nvmlDeviceGetProcessUtilization(handle, last_seen)
+    except pynvml.NVMLError_NotFound:
+        return 0.0  # No new samples since the previous call
+    except pynvml.NVMLError:
+        return None  # E.g. not supported or no permission, use the device-wide value
 
-    total_mem = 0
-    for proc in pids:
-        try:
-            mem_info = proc.memory_info()
-            total_mem += mem_info.rss  # Count physical memory (RAM)
-        except (psutil.NoSuchProcess, psutil.AccessDenied):
-            continue  # Ignore processes we can't access
-    return total_mem / (1024 * 1024)  # Convert bytes to MB
+    sm_utils: Dict[int, List[int]] = {}
+    for sample in samples:
+        last_seen = max(last_seen, sample.timeStamp)
+        if sample.pid in pids:
+            sm_utils.setdefault(sample.pid, []).append(sample.smUtil)
+    _gpu_util_timestamps[index] = last_seen
+    return sum(fmean(utils) for utils in sm_utils.values())
 
 
-def total_gpu_usage(pids: List[int]) -> tuple:
-    """Return total GPU and VRAM usage (%) for a list of process IDs.
+def total_gpu_usage(pids: Set[int], handles: list) -> tuple:
+    """Return total GPU and VRAM usage (%) for a set of process IDs.
+
+    GPU usage is attributed per process where the GPU supports it, and falls back to
+    the device-wide utilization otherwise.
 
     Args:
-        pids: List of process IDs to monitor.
+        pids: Set of process IDs to monitor.
+        handles: NVML handles of the GPUs to query.
 
     Returns:
         Tuple containing total GPU usage (%) and total VRAM usage (MB) for the
@@ -106,14 +353,19 @@ def total_gpu_usage(pids: List[int]) -> tuple:
     total_vram_usage = 0
 
     try:
-        device_count = pynvml.nvmlDeviceGetCount()
-        for i in range(device_count):
-            handle = pynvml.nvmlDeviceGetHandleByIndex(i)
+        for index, handle in enumerate(handles):
             processes = pynvml.nvmlDeviceGetComputeRunningProcesses(handle)
+            device_used = False
             for proc_info in processes:
                 if proc_info.pid in pids:
-                    total_usage += pynvml.nvmlDeviceGetUtilizationRates(handle).gpu
+                    device_used = True
                     total_vram_usage += proc_info.usedGpuMemory / (1024 * 1024)  # MB
+
+            usage = process_gpu_utilization(index, handle, pids)
+            if usage is None and device_used:
+                # Utilization is reported per device, so count it once per GPU.
+                usage = pynvml.nvmlDeviceGetUtilizationRates(handle).gpu
+            total_usage += usage or 0
     except Exception:
         pass  # Ignore errors (e.g., no GPU available)
     return total_usage, total_vram_usage
@@ -128,8 +380,17 @@ def find_pid_by_name(name: str) -> int:
     Returns:
         Process ID of the process with the given name.
     """
-    for proc in psutil.process_iter(["pid", "name", "cmdline"]):
-        if proc.info["cmdline"] and name in proc.info["cmdline"]:
+    own_pid = os.getpid()
+    for proc in psutil.process_iter(["pid", "name"]):
+        if proc.info["pid"] == own_pid:
+            continue  # Our own command line may contain the name as an argument
+        try:
+            # Check the cheap process name first and only read the command line,
+            # which is among the most expensive attributes, when it doesn't match.
+            found = proc.info["name"] == name or name in proc.cmdline()
+        except (psutil.NoSuchProcess, psutil.AccessDenied, psutil.ZombieProcess):
+            continue  # Ignore processes that disappeared or we can't access
+        if found:
             found_pid = proc.info["pid"]
             click.echo(
                 click.style(f"Found process '{name}' with PID {found_pid}.", fg="green")
@@ -139,6 +400,73 @@ def find_pid_by_name(name: str) -> int:
     return None
 
 
+def start_py_spy(
+    pid: int,
+    duration: int,
+    spy_output: str,
+    stderr: IO[str],
+    rate: int = 100,
+    native: bool = False,
+    idle: bool = False,
+    subprocesses: bool = False,
+) -> Optional[subprocess.Popen]:
+    """Start py-spy in the background to record a profile of the given process.
+
+    Args:
+        pid: Process ID to profile.
+        duration: Recording duration in seconds.
+        spy_output: Py-Spy output file.
+        stderr: File that receives py-spy's error output.
+        rate: Number of samples per second.
+        native: Also collect stack traces from native extensions.
+        idle: Also include samples from idle threads.
+        subprocesses: Also profile the subprocesses of the process.
+
+    Returns:
+        The running py-spy process, or None if it could not be started.
+    """
+    click.echo(click.style("Running py-spy for deep profiling...", fg="green"))
+    spy_cmd = [
+        "py-spy",
+        "record",
+        "-o",
+        spy_output,
+        "--pid",
+        str(pid),
+        "--duration",
+        str(duration),
+        "--rate",
+        str(rate),
+    ]
+    if native:
+        spy_cmd.append("--native")
+    if idle:
+        spy_cmd.append("--idle")
+    if subprocesses:
+        spy_cmd.append("--subprocesses")
+    try:
+        return subprocess.Popen(spy_cmd, stdout=subprocess.DEVNULL, stderr=stderr)
+    except OSError as e:
+        click.echo(click.style(f"Error running py-spy: {e}", fg="red"))
+        return None
+
+
+def wait_for_py_spy(spy_process: subprocess.Popen, stderr: IO[str], spy_output: str):
+    """Wait for a py-spy process started by `start_py_spy` and report its result.
+
+    Args:
+        spy_process: The running py-spy process.
+        stderr: File that received py-spy's error output.
+        spy_output: Py-Spy output file.
+    """
+    spy_process.wait()
+    if spy_process.returncode == 0:
+        click.echo(click.style(f"Py-Spy flame graph saved to {spy_output}", fg="green"))
+    else:
+        stderr.seek(0)
+        click.echo(click.style(f"Error running py-spy: {stderr.read()}", fg="red"))
+
+
 @click.command()
 @click.option(
     "--pid", type=str, default="auto", help='Process ID or "auto" to find by name'
@@ -146,15 +474,48 @@ def find_pid_by_name(name: str) -> int:
 @click.option(
     "--name", type=str, default="app.py", help="Process name (default: app.py)"
 )
-@click.option("--interval", type=int, default=2, help="Monitoring interval (seconds)")
+@click.option(
+    "--interval",
+    type=click.IntRange(min=1),
+    default=2,
+    help="Monitoring interval (seconds)",
+)
 @click.option(
     "--duration", type=int, default=30, help="Total monitoring duration (seconds)"
 )
 @click.option("--output", type=str, default=None, help="File to save logs (optional)")
+@click.option("--quiet", is_flag=True, help="Only print the averages, not each sample")
 @click.option("--spy", is_flag=True, help="Enable py-spy profiling")
 @click.option(
     "--spy-output", type=str, default="pyspy_profile.svg", help="Py-Spy output file"
 )
+@click.option(
+    "--spy-rate",
+    type=click.IntRange(min=1),
+    default=100,
+    help="Py-Spy samples per second. Lower it to reduce profiling overhead.",
+)
+@click.option(
+    "--spy-native/--no-spy-native",
+    default=False,
+    help="Collect native stack traces with py-spy (adds overhead).",
+)
+@click.option(
+    "--spy-idle/--no-spy-idle",
+    default=False,
+    help="Include idle threads in the py-spy profile.",
+)
+@click.option(
+    "--spy-subprocesses/--no-spy-subprocesses",
+    default=False,
+    help="Profile subprocesses of the target process with py-spy.",
+)
+@click.option(
+    "--ignore-names",
+    type=str,
+    default=None,
+    help="Regex matching the names of child processes to leave out of the totals.",
+)
 @click.option(
     "--host-pid",
     type=int,
@@ -167,8 +528,14 @@ def monitor_resources(
     interval: int,
     duration: int,
     output: str,
+    quiet: bool,
     spy: bool,
     spy_output: str,
+    spy_rate: int,
+    spy_native: bool,
+    spy_idle: bool,
+    spy_subprocesses: bool,
+    ignore_names: str,
     host_pid: int,
 ):
     """Monitor system resources for a given PID and optionally create a py-spy profiler
@@ -180,10 +547,22 @@ def monitor_resources(
         interval (int): Monitoring interval in seconds.
         duration (int): Total monitoring duration in seconds.
         output (str): File to save logs (optional).
+        quiet (bool): Only print the averages, not each sample.
         spy (bool): Enable py-spy profiling.
         spy_output (str): Py-Spy output file.
+        spy_rate (int): Py-Spy samples per second.
+        spy_native (bool): Collect native stack traces with py-spy.
+        spy_idle (bool): Include idle threads in the py-spy profile.
+        spy_subprocesses (bool): Profile subprocesses with py-spy.
+        ignore_names (str): Regex matching child process names to skip (optional).
         host_pid (int): Host PID for GPU monitoring (useful inside containers).
     """
+    try:
+        ignore_re = re.compile(ignore_names) if ignore_names else None
+    except re.error as e:
+        click.echo(click.style(f"Error: Invalid --ignore-names pattern: {e}", fg="red"))
+        return
+
     if pid == "auto":
         pid = find_pid_by_name(name)
         if pid is None:
@@ -209,99 +588,131 @@ def monitor_resources(
                 )
             )
 
-    if not psutil.pid_exists(pid):
+    try:
+        parent = psutil.Process(pid)
+    except (psutil.NoSuchProcess, ValueError):
         click.echo(click.style(f"Error: Process with PID {pid} not found.", fg="red"))
         return
+    if pid == os.getpid():
+        click.echo(click.style("Error: Cannot monitor the monitor itself.", fg="red"))
+        return
 
     click.echo(
         click.style(f"Monitoring PID {pid} for {duration} seconds...", fg="green")
     )
 
-    def run_py_spy():
-        """Run py-spy profiler for deep profiling."""
-        click.echo(click.style("Running py-spy for deep profiling...", fg="green"))
-        spy_cmd = f"py-spy record -o {spy_output} --pid {pid} --duration {duration}"
-        try:
-            subprocess.run(
-                spy_cmd, shell=True, check=True, capture_output=True, text=True
-            )
-            click.echo(
-                click.style(f"Py-Spy flame graph saved to {spy_output}", fg="green")
-            )
-        except subprocess.CalledProcessError as e:
-            click.echo(click.style(f"Error running py-spy: {e.stderr}", fg="red"))
-
-    # Start py-spy profiling in a separate thread if enabled.
+    # Start py-spy profiling in a separate process if enabled.
+    # py-spy's error output goes to a file rather than a pipe, which isn't read until
+    # monitoring ends and could otherwise fill up and block py-spy on long runs.
+    spy_process = None
+    spy_stderr = None
     if spy:
-        spy_thread = threading.Thread(target=run_py_spy)
-        spy_thread.start()
+        spy_stderr = tempfile.TemporaryFile(mode="w+")
+        spy_process = start_py_spy(
+            pid,
+            duration,
+            spy_output,
+            spy_stderr,
+            rate=spy_rate,
+            native=spy_native,
+            idle=spy_idle,
+            subprocesses=spy_subprocesses,
+        )
+
+    # Stream samples to the output file as they are collected so that memory stays
+    # bounded and partial results survive an interrupted run.
+    csvfile = None
+    if output:
+        csvfile = open(output, "w", buffering=CSV_BUFFER_SIZE, newline="")
+        atexit.register(csvfile.close)
+        writer = csv.writer(csvfile)
+        writer.writerow(CSV_FIELDNAMES)
 
     # Start main resources monitoring loop.
-    pynvml.nvmlInit()
-    monitor_start_time = time.time()
-    end_time = time.time() + duration
-    logs = []
-    cpu_usages, ram_usages, gpu_usages, vram_usages = [], [], [], []
-    while time.time() < end_time:
-        start_time = time.time()
-        elapsed_monitor_time = time.time() - monitor_start_time
-        progress = (elapsed_monitor_time / duration) * 100
+    ensure_nvml()
+    gpu_handles = get_gpu_handles()
+    # Keep the monitor and py-spy out of the totals in case they were launched from
+    # within the monitored process tree.
+    exclude_pids = {os.getpid()}
+    if spy_process:
+        exclude_pids.add(spy_process.pid)
+    process_tree = ProcessTreeCache(parent, exclude_pids=exclude_pids)
+    # Prime the CPU time deltas so that every sample covers a full interval.
+    terminated = False
+    try:
+        sample_all(process_tree, gpu_handles, host_pid, ignore_re)
+    except psutil.NoSuchProcess:
+        click.echo(click.style("Error: Process terminated!", fg="red"))
+        terminated = True
+    # Schedule samples on the monotonic clock so that wall-clock adjustments and
+    # per-sample jitter don't make the sampling period drift.
+    monitor_start_time = time.monotonic()
+    end_time = monitor_start_time + duration
+    # Take as many samples as there are (possibly partial) intervals in the duration,
+    # with the remainder covered by the first one, so short runs still get a sample.
+    num_samples = -(-duration // interval)
+    next_tick = end_time - (num_samples - 1) * interval
+    # Only running totals are needed for the averages, per-sample rows are streamed
+    # to the output file.
+    sample_count = 0
+    total_cpu = total_ram = total_gpu = total_vram = 0.0
+    while not terminated and next_tick <= end_time:
         try:
-            all_processes = get_all_processes(pid)
-            cpu_usage = total_cpu_percent(all_processes)
-            memory_usage = total_memory(all_processes)
-            gpu_usage, vram_usage = total_gpu_usage(
-                [proc.pid for proc in all_processes] if not host_pid else [host_pid]
+            time.sleep(max(0.0, next_tick - time.monotonic()))
+            progress = min(
+                100.0, (time.monotonic() - monitor_start_time) / duration * 100
             )
-
-            log_entry = {
-                "CPU (%)": cpu_usage,
-                "RAM (MB)": memory_usage,
-                "GPU (%)": gpu_usage,
-                "VRAM (MB)": vram_usage,
-            }
-            click.echo(
-                f"[{progress:.1f}%] CPU: {cpu_usage:.2f}%, RAM: {memory_usage:.2f}MB, "
-                f"GPU: {gpu_usage:.2f}%, VRAM: {vram_usage:.2f}MB"
+            cpu_usage, memory_usage, gpu_usage, vram_usage = sample_all(
+                process_tree, gpu_handles, host_pid, ignore_re
             )
-            logs.append(log_entry)
-            cpu_usages.append(cpu_usage)
-            ram_usages.append(memory_usage)
-            gpu_usages.append(gpu_usage)
-            vram_usages.append(vram_usage)
-
-            # Adjust sleep time to maintain exact interval
-            elapsed_time = time.time() - start_time
-            sleep_time = max(0, interval - elapsed_time)
-            time.sleep(sleep_time)
+
+            if not quiet:
+                click.echo(
+                    SAMPLE_LOG_TEMPLATE
+                    % (progress, cpu_usage, memory_usage, gpu_usage, vram_usage)
+                )
+            sample_count += 1
+            total_cpu += cpu_usage
+            total_ram += memory_usage
+            total_gpu += gpu_usage
+            total_vram += vram_usage
+            if csvfile:
+                writer.writerow((cpu_usage, memory_usage, gpu_usage, vram_usage))
+                # Periodically flush so that rows survive a crash of the monitor.
+                if sample_count % CSV_FLUSH_EVERY == 0:
+                    csvfile.flush()
+
+            # Schedule the next tick, skipping the ones that were missed.
+            next_tick += interval
+            now = time.monotonic()
+            while next_tick <= now:
+                next_tick += interval
         except psutil.NoSuchProcess:
             click.echo(click.style("Error: Process terminated!", fg="red"))
             break
-
-    pynvml.nvmlShutdown()
+        except KeyboardInterrupt:
+            click.echo(click.style("Monitoring interrupted.", fg="yellow"))
+            break
 
     # Calculate and log averages
-    avg_cpu = sum(cpu_usages) / len(cpu_usages) if cpu_usages else 0
-    avg_ram = sum(ram_usages) / len(ram_usages) if ram_usages else 0
-    avg_gpu = sum(gpu_usages) / len(gpu_usages) if gpu_usages else 0
-    avg_vram = sum(vram_usages) / len(vram_usages) if vram_usages else 0
+    avg_cpu = total_cpu / sample_count if sample_count else 0
+    avg_ram = total_ram / sample_count if sample_count else 0
+    avg_gpu = total_gpu / sample_count if sample_count else 0
+    avg_vram = total_vram / sample_count if sample_count else 0
 
     click.echo(
         f"AVERAGE - CPU: {avg_cpu:.2f}%, RAM: {avg_ram:.2f}MB, GPU: {avg_gpu:.2f}%, VRAM: {avg_vram:.2f}MB"
     )
 
-    # Save logs if output file is provided.
-    if output:
-        with open(output, "w", newline="") as csvfile:
-            fieldnames = ["CPU (%)", "RAM (MB)", "GPU (%)", "VRAM (MB)"]
-            writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-            writer.writeheader()
-            writer.writerows(logs)
+    if csvfile:
+        csvfile.close()
         click.echo(click.style(f"Logs saved to {output}", fg="green"))
 
-    # Wait for py-spy thread to finish if it was started.
-    if spy:
-        spy_thread.join()
+    # Wait for py-spy to finish if it was started.
+    if spy_process:
+        wait_for_py_spy(spy_process, spy_stderr, spy_output)
+    if spy_stderr:
+        spy_stderr.close()
 
 
 if __name__ == "__main__":